@@ -1,21 +1,35 @@
 # app/analyzer.py
+import functools
 import re
-from typing import List, Dict, Any, Tuple, Optional
-
-# Regex patterns (case-insensitive, deterministic)
-RE_LOOP_START = re.compile(r'^\s*LOOP\b', re.IGNORECASE)
-RE_DO_START = re.compile(r'^\s*DO\b', re.IGNORECASE)
-RE_WHILE_START = re.compile(r'^\s*WHILE\b', re.IGNORECASE)
-
-RE_ENDLOOP = re.compile(r'^\s*ENDLOOP\b', re.IGNORECASE)
-RE_ENDDO = re.compile(r'^\s*ENDDO\b', re.IGNORECASE)
-RE_ENDWHILE = re.compile(r'^\s*ENDWHILE\b', re.IGNORECASE)
-
-# SELECT statements, but not SELECT-OPTIONS (selection screen)
-RE_SELECT_SQL = re.compile(r'^\s*SELECT(?!-OPTIONS)\b', re.IGNORECASE)
-
-# FOR ALL ENTRIES pattern
-RE_FOR_ALL_ENTRIES = re.compile(r'\bFOR\s+ALL\s+ENTRIES\s+IN\b', re.IGNORECASE)
+import sys
+from bisect import bisect_right
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import List, Dict, Any, Iterator, Tuple
+
+from app.schemas import Finding, PayloadItem, ResponseItem
+
+# One multiline pass over the joined upper-cased lines finds every
+# statement keyword (anchored at line start, since the lines are
+# left-stripped) and every FOR ALL ENTRIES occurrence. Case-sensitive:
+# the text is already upper-cased. FOR ALL ENTRIES uses [ \t] rather
+# than \s so it cannot spill across the joining newlines.
+RE_TOKENS = re.compile(
+    r'^(?P<tok>ENDLOOP|ENDDO|ENDWHILE|LOOP|DO|WHILE|SELECT(?!-OPTIONS))\b'
+    r'|\bFOR[ \t]+ALL[ \t]+ENTRIES[ \t]+IN\b',
+    re.MULTILINE,
+)
+
+# Maps the matched keyword to (kind, block type); SELECT has no block type.
+_TOKEN_KIND = {
+    "LOOP": ("START", "LOOP"),
+    "DO": ("START", "DO"),
+    "WHILE": ("START", "WHILE"),
+    "ENDLOOP": ("END", "LOOP"),
+    "ENDDO": ("END", "DO"),
+    "ENDWHILE": ("END", "WHILE"),
+    "SELECT": ("SELECT", None),
+}
 
 SUGGEST_NESTED_LOOPS = "avoid nested loop for performance optimization."
 SUGGEST_SELECT_IN_LOOP = "avoid select inside loop for performance optimization."
@@ -25,208 +39,151 @@ SUGGEST_FOR_ALL_ENTRIES = "avoid select with for all entries , with relevant sel
 def strip_abab_line_comments(line: str) -> str:
     """
     Remove full-line '*' comments and strip trailing double-quote comments.
+    Lines with neither — the vast majority — come back as the original
+    string object, with no intermediate allocation.
     """
-    if line.lstrip().startswith("*"):
+    first = 0
+    n = len(line)
+    while first < n and line[first] in " \t":
+        first += 1
+    if first < n and line[first] == "*":
         return ""
-    quote_idx = line.find('"')
+    quote_idx = line.find('"', first)
     if quote_idx != -1:
         return line[:quote_idx]
     return line
 
 
-def normalize_newlines(text: str) -> str:
-    return (text or "").replace("\r\n", "\n").replace("\r", "\n")
-
-
-def build_lines(code: str) -> List[Dict[str, Any]]:
+def build_lines(code: str) -> Tuple[List[str], List[str]]:
     """
-    Build per-line structures with:
-      - no: 1-based line number within the local code block
-      - raw: original line text
-      - clean: text after removing ABAP comments
+    Build parallel per-line arrays:
+      - raws: original line text
+      - uppers: comment-stripped, left-stripped, upper-cased text that
+        every rule matches against (case folding happens exactly once)
+    The 1-based local line number of line i is simply i + 1.
     """
-    code = normalize_newlines(code or "")
-    lines = code.split("\n")
-    result = []
-    for i, raw in enumerate(lines, start=1):
-        clean = strip_abab_line_comments(raw)
-        result.append({"no": i, "raw": raw, "clean": clean})
-    return result
+    # splitlines handles \r\n / \r / \n natively in one pass, with no
+    # intermediate normalized copy of the source.
+    raws = (code or "").splitlines()
+    strip = strip_abab_line_comments  # local alias: no global lookup per line
+    uppers = [strip(raw).lstrip().upper() for raw in raws]
+    return raws, uppers
 
 
-def is_loop_start(text: str) -> Optional[str]:
-    if RE_LOOP_START.match(text):
-        return "LOOP"
-    if RE_DO_START.match(text):
-        return "DO"
-    if RE_WHILE_START.match(text):
-        return "WHILE"
-    return None
-
-
-def is_loop_end(text: str) -> Optional[str]:
-    if RE_ENDLOOP.match(text):
-        return "LOOP"
-    if RE_ENDDO.match(text):
-        return "DO"
-    if RE_ENDWHILE.match(text):
-        return "WHILE"
-    return None
-
-
-def find_matching_end(lines: List[Dict[str, Any]], start_idx: int, block_type: str) -> Optional[int]:
+@dataclass(frozen=True)
+class RawFinding:
     """
-    Given a loop start at start_idx, find its matching ENDLOOP/ENDDO/ENDWHILE,
-    respecting nested blocks of the same type.
+    A rule hit with its snippet kept as line indices into the raws
+    array; the snippet text is only built if a response asks for it.
     """
-    depth = 1
-    for i in range(start_idx + 1, len(lines)):
-        clean = lines[i]["clean"]
-        if not clean.strip():
-            continue
-        if is_loop_start(clean) == block_type:
-            depth += 1
-        elif is_loop_end(clean) == block_type:
-            depth -= 1
-            if depth == 0:
-                return i
-    return None
-
-
-def collect_loop_blocks(lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """
-    Collect all LOOP/DO/WHILE blocks with start and end indices.
-    """
-    blocks = []
-    stack: List[Tuple[str, int]] = []
-    for idx, ld in enumerate(lines):
-        clean = ld["clean"]
-        if not clean.strip():
-            continue
-        start_type = is_loop_start(clean)
-        end_type = is_loop_end(clean)
-        if start_type:
-            stack.append((start_type, idx))
-        elif end_type:
-            # pop back to matching start
-            for s in range(len(stack) - 1, -1, -1):
-                t, sidx = stack[s]
-                if t == end_type:
-                    end_idx = idx
-                    blocks.append({"type": t, "start_idx": sidx, "end_idx": end_idx})
-                    stack = stack[:s]
-                    break
-    blocks.sort(key=lambda b: b["start_idx"])
-    return blocks
-
-
-def find_nested_loops(lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    suggestion: str
+    line: int           # 1-based local line number
+    start: int          # first line index of the snippet
+    end: int            # last line index (inclusive)
+    pair: bool = False  # True: snippet is loop header + statement line only
+
+    def materialize(self, raws: List[str]) -> str:
+        if self.pair:
+            # One LOOP often holds many SELECTs: intern the stripped
+            # header so the copies all share a single string object.
+            header = sys.intern(raws[self.start].strip())
+            return f"{header}\n{raws[self.end].strip()}"
+        return "\n".join(raws[self.start:self.end + 1]).strip()
+
+
+def scan(raws: List[str], uppers: List[str]) -> Iterator[RawFinding]:
     """
-    Detect nested LOOP/DO/WHILE.
-    We keep:
-      - suggestion
-      - multi-line snippet (inner loop header and a few lines below)
-      - local line number where inner loop starts
+    Single pass over the source, yielding raw findings for all three
+    rules (nested loops, SELECT inside loop, FOR ALL ENTRIES). The
+    upper-cased lines are joined once and RE_TOKENS.finditer walks the
+    whole text in one C-level call, so Python only touches the lines
+    that actually carry a keyword; match offsets map back to line
+    indices through a cumulative offset array and bisect.
+
+    A stack of open (type, idx) loop headers tracks nesting, so no
+    per-loop re-scan for the matching ENDLOOP/ENDDO/ENDWHILE is needed:
+      - a loop start while the stack is non-empty is a nested loop; its
+        snippet is the inner header plus up to ~10 lines below
+      - a SELECT while the stack is non-empty is a SELECT inside the
+        innermost open loop; its snippet is loop header + select line
+      - a FOR ALL ENTRIES match yields a 3-line snippet (prev, current, next)
+    Findings come out in line order rather than grouped by rule.
     """
-    findings = []
+    n = len(raws)
+    text = "\n".join(uppers)
+    # starts[i] = offset of line i in text; bisect maps offset -> line.
+    starts = list(accumulate((len(u) + 1 for u in uppers), initial=0))
     stack: List[Tuple[str, int]] = []
-    for idx, ld in enumerate(lines):
-        text = ld["clean"]
-        if not text.strip():
+    last_fae_idx = -1  # one FOR ALL ENTRIES finding per line, as before
+    for m in RE_TOKENS.finditer(text):
+        idx = bisect_right(starts, m.start()) - 1
+        tok = m.group("tok")
+        if tok is None:  # FOR ALL ENTRIES branch
+            if idx != last_fae_idx:
+                last_fae_idx = idx
+                yield RawFinding(
+                    suggestion=SUGGEST_FOR_ALL_ENTRIES,
+                    line=idx + 1,
+                    start=max(0, idx - 1),
+                    end=min(n - 1, idx + 1),
+                )
             continue
-        stype = is_loop_start(text)
-        etype = is_loop_end(text)
-        if stype:
-            # Nested loop if we already have one on stack
-            if any(t in ("LOOP", "DO", "WHILE") for (t, _) in stack):
-                inner_start_idx = idx
-                inner_end_idx = find_matching_end(lines, inner_start_idx, stype)
-
-                snippet_lines: List[str] = []
-                if inner_end_idx is not None:
-                    # capture inner block header + up to ~10 lines after, or until end
-                    end_clip = min(inner_end_idx, inner_start_idx + 11)
-                    for j in range(inner_start_idx, end_clip + 1):
-                        snippet_lines.append(lines[j]["raw"])
-                else:
-                    # no matching end found; just take a few lines after
-                    end_clip = min(len(lines) - 1, inner_start_idx + 5)
-                    for j in range(inner_start_idx, end_clip + 1):
-                        snippet_lines.append(lines[j]["raw"])
-
-                findings.append({
-                    "suggestion": SUGGEST_NESTED_LOOPS,
-                    "snippet": "\n".join(snippet_lines).strip(),
-                    "line": lines[inner_start_idx]["no"],  # local line number
-                })
-
-            stack.append((stype, idx))
-
-        elif etype:
-            # pop to matching loop
-            for s in range(len(stack) - 1, -1, -1):
-                t, _ = stack[s]
-                if t == etype:
-                    stack = stack[:s]
-                    break
-    return findings
-
-
-def find_select_inside_loops(lines: List[Dict[str, Any]], loop_blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        kind, btype = _TOKEN_KIND[tok]
+        if kind == "START":
+            if stack:
+                yield RawFinding(
+                    suggestion=SUGGEST_NESTED_LOOPS,
+                    line=idx + 1,  # local line number
+                    start=idx,
+                    end=min(n - 1, idx + 11),
+                )
+            stack.append((btype, idx))
+        elif kind == "END":
+            # In well-formed code the innermost open loop is the
+            # match; scan downward only on mismatch.
+            if stack and stack[-1][0] == btype:
+                stack.pop()
+            else:
+                for s in range(len(stack) - 1, -1, -1):
+                    if stack[s][0] == btype:
+                        del stack[s:]
+                        break
+        elif stack:  # SELECT inside an open loop
+            yield RawFinding(
+                suggestion=SUGGEST_SELECT_IN_LOOP,
+                line=idx + 1,
+                start=stack[-1][1],  # loop header line
+                end=idx,
+                pair=True,
+            )
+
+
+@functools.lru_cache(maxsize=1024)
+def _analyze_code(code: str, base_start_line: int,
+                  include_snippets: bool = True) -> Tuple[Tuple[int, str, str], ...]:
     """
-    Detect SELECT inside any loop block.
-    For each SELECT line inside a loop, we capture:
-      - suggestion text
-      - 2-line snippet (loop header + select line)
-      - local line number of SELECT
+    Run the scanner over a code block and return an immutable tuple of
+    (absolute line, suggestion, snippet) triples. Cached so re-submitted
+    identical code (IDE integrations re-POST on every save) costs a
+    dict lookup; metadata like program/include names stays outside the
+    key, so renames still hit. The scanner keeps snippets as line spans;
+    text is only built here, and skipped entirely for summary/count
+    consumers that pass include_snippets=False.
     """
-    findings = []
-    for block in loop_blocks:
-        sidx = block["start_idx"]
-        eidx = block["end_idx"]
-        loop_header = lines[sidx]["raw"].strip()
-        reported_line_nos = set()
-        for i in range(sidx + 1, eidx + 1):
-            clean = lines[i]["clean"]
-            if RE_SELECT_SQL.match(clean):
-                line_no = lines[i]["no"]
-                if line_no in reported_line_nos:
-                    continue
-                reported_line_nos.add(line_no)
-                select_line = lines[i]["raw"].strip()
-                snippet = f"{loop_header}\n{select_line}"
-                findings.append({
-                    "suggestion": SUGGEST_SELECT_IN_LOOP,
-                    "snippet": snippet,
-                    "line": line_no,
-                })
-    return findings
-
-
-def find_for_all_entries(lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """
-    Detect FOR ALL ENTRIES patterns.
-    For each occurrence, we capture:
-      - suggestion
-      - 3-line snippet (previous, current, next)
-      - local line number of the FAE line
-    """
-    findings = []
-    for i, ld in enumerate(lines):
-        clean = ld["clean"]
-        if RE_FOR_ALL_ENTRIES.search(clean):
-            start = max(0, i - 1)
-            end = min(len(lines) - 1, i + 1)
-            snippet_lines = [lines[j]["raw"] for j in range(start, end + 1)]
-            findings.append({
-                "suggestion": SUGGEST_FOR_ALL_ENTRIES,
-                "snippet": "\n".join(snippet_lines).strip(),
-                "line": lines[i]["no"],
-            })
-    return findings
+    raws, uppers = build_lines(code)
+    results = []
+    for f in scan(raws, uppers):
+        local_line_no = f.line
+        if local_line_no > 0:
+            abs_line = base_start_line + local_line_no - 1
+        else:
+            abs_line = base_start_line
+        snippet = f.materialize(raws) if include_snippets else ""
+        results.append((abs_line, f.suggestion, snippet))
+    return tuple(results)
 
 
-def analyze_item(item: Dict[str, Any]) -> Dict[str, Any]:
+def analyze_item(item: PayloadItem, include_snippets: bool = True) -> ResponseItem:
     """
     Core logic: unchanged detection, only response shape adapted
     to the Credit Master 'final format' style plus:
@@ -234,48 +191,76 @@ def analyze_item(item: Dict[str, Any]) -> Dict[str, Any]:
       - severity forced to 'error'
       - multiline snippet preserved as constructed above
     """
-    code = item.get("code", "") or ""
-    lines = build_lines(code)
+    code = item.code or ""
 
     # Base (absolute) start line of this code block in the original program
     # If not provided, assume 1.
+    base_start_line = item.start_line or 1
+
+    # Stitch per-item metadata over the (possibly cached) analysis;
+    # model_construct skips validation because this data is produced by
+    # our own code, not the wire.
+    findings_final: List[Finding] = []
+    for abs_line, suggestion, snippet in _analyze_code(code, base_start_line, include_snippets):
+        findings_final.append(Finding.model_construct(
+            prog_name=item.pgm_name,
+            incl_name=item.inc_name,
+            types=item.type,
+            blockname=item.name,
+            starting_line=abs_line,
+            ending_line=abs_line,
+            issues_type="PerformanceIssue",             # fixed type label
+            severity="error",                           # ALWAYS error as per your requirement
+            message=f"Performance issue: {suggestion}",
+            suggestion=suggestion,
+            snippet=snippet,                            # multiline snippet preserved
+        ))
+
+    return ResponseItem.model_construct(
+        pgm_name=item.pgm_name,
+        inc_name=item.inc_name,
+        type=item.type,
+        name=item.name,
+        code=code,
+        findings=findings_final,
+    )
+
+
+def analyze_item_dict(item: Dict[str, Any], include_snippets: bool = True) -> Dict[str, Any]:
+    """
+    Plain-dict twin of analyze_item for callers that bypass Pydantic
+    (the orjson fast path): takes a payload dict, returns a fully
+    JSON-ready response dict with the same shape and field order.
+    """
+    code = item.get("code") or ""
     base_start_line = item.get("start_line") or 1
-
-    # Collect raw findings from the three rules
-    raw_findings: List[Dict[str, Any]] = []
-    raw_findings.extend(find_nested_loops(lines))
-    loop_blocks = collect_loop_blocks(lines)
-    raw_findings.extend(find_select_inside_loops(lines, loop_blocks))
-    raw_findings.extend(find_for_all_entries(lines))
-
-    # Build final-format response
-    findings_final: List[Dict[str, Any]] = []
-    for f in raw_findings:
-        local_line_no = f.get("line", 0) or 0
-        if local_line_no > 0:
-            abs_line = base_start_line + local_line_no - 1
-        else:
-            abs_line = base_start_line
-
-        findings_final.append({
-            "prog_name": item.get("pgm_name"),
-            "incl_name": item.get("inc_name"),
-            "types": item.get("type"),
-            "blockname": item.get("name"),
+    pgm_name = item.get("pgm_name")
+    inc_name = item.get("inc_name")
+    type_ = item.get("type")
+    name = item.get("name")
+
+    findings_final = [
+        {
+            "prog_name": pgm_name,
+            "incl_name": inc_name,
+            "types": type_,
+            "blockname": name,
             "starting_line": abs_line,
             "ending_line": abs_line,
-            "issues_type": "PerformanceIssue",          # fixed type label
-            "severity": "error",                        # ALWAYS error as per your requirement
-            "message": f"Performance issue: {f['suggestion']}",
-            "suggestion": f["suggestion"],
-            "snippet": f["snippet"],                    # multiline snippet preserved
-        })
+            "issues_type": "PerformanceIssue",
+            "severity": "error",
+            "message": f"Performance issue: {suggestion}",
+            "suggestion": suggestion,
+            "snippet": snippet,
+        }
+        for abs_line, suggestion, snippet in _analyze_code(code, base_start_line, include_snippets)
+    ]
 
     return {
-        "pgm_name": item.get("pgm_name"),
-        "inc_name": item.get("inc_name"),
-        "type": item.get("type"),
-        "name": item.get("name"),
+        "pgm_name": pgm_name,
+        "inc_name": inc_name,
+        "type": type_,
+        "name": name,
         "code": code,
         "findings": findings_final,
     }
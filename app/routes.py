@@ -1,11 +1,32 @@
 # app/routes.py
-from typing import List
-from fastapi import APIRouter
+import asyncio
+import os
+
+import anyio.to_thread
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import orjson
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from app.schemas import PayloadItem, ResponseItem
-from app.analyzer import analyze_item
+from app.analyzer import analyze_item, analyze_item_dict
 
 router = APIRouter()
 
+# analyze_item is a pure function of its item, so large batches fan out
+# across cores. Batches below this size stay inline: the pickling/IPC
+# overhead would outweigh the parallelism.
+_PARALLEL_MIN_ITEMS = 4
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _pool
+
 example_request = [
     {
         "pgm_name": "Z_DEMO",
@@ -36,7 +57,8 @@ example_request = [
     "/remediate-array",
     response_model=List[ResponseItem],
     summary="Analyze ABAP code for performance issues (array)",
-    description="Accepts an array of payload objects and returns an array with findings for each item.",
+    description="Accepts an array of payload objects and returns an array with findings for each item. "
+                "Pass ?snippets=false to omit snippet text for summary/count consumers.",
     openapi_extra={
         "requestBody": {
             "content": {
@@ -52,12 +74,49 @@ example_request = [
         }
     },
 )
-async def remediate_array(payload: List[PayloadItem]) -> List[ResponseItem]:
-    results: List[ResponseItem] = []
+async def remediate_array(payload: List[PayloadItem], snippets: bool = True) -> List[ResponseItem]:
+    if len(payload) >= _PARALLEL_MIN_ITEMS:
+        loop = asyncio.get_running_loop()
+        pool = _get_pool()
+        analyzed = await asyncio.gather(
+            *[loop.run_in_executor(pool, analyze_item, item, snippets) for item in payload]
+        )
+    else:
+        # Too small for the process pool, but still CPU-bound: run on a
+        # worker thread so the event loop keeps serving other requests.
+        analyzed = await asyncio.gather(
+            *[anyio.to_thread.run_sync(analyze_item, item, snippets) for item in payload]
+        )
+    return list(analyzed)
+
+
+@router.post(
+    "/remediate-array-fast",
+    summary="Analyze ABAP code for performance issues (array, fast path)",
+    description="Same contract as /remediate-array but parses the body with orjson and skips "
+                "Pydantic validation of the hot fields; use /remediate-array for the documented schema.",
+)
+async def remediate_array_fast(request: Request) -> ORJSONResponse:
+    # Thin validation of the hot fields only: the documented endpoints
+    # return 422 for bad payloads, so bad input must not surface as 500.
+    try:
+        payload = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Malformed JSON body")
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of objects")
     for item in payload:
-        analyzed_dict = analyze_item(item.model_dump())
-        results.append(ResponseItem(**analyzed_dict))
-    return results
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of objects")
+        if not isinstance(item.get("code") or "", str):
+            raise HTTPException(status_code=400, detail="'code' must be a string")
+        if not isinstance(item.get("start_line") or 1, int):
+            raise HTTPException(status_code=400, detail="'start_line' must be an integer")
+    snippets = request.query_params.get("snippets", "true").lower() != "false"
+    results = await anyio.to_thread.run_sync(
+        lambda: [analyze_item_dict(item, snippets) for item in payload]
+    )
+    return ORJSONResponse(results)
 
 
 @router.post(
@@ -67,5 +126,6 @@ async def remediate_array(payload: List[PayloadItem]) -> List[ResponseItem]:
     description="Accepts a single payload object and returns findings wrapped in a list (for consistency).",
 )
 async def remediate_single(item: PayloadItem) -> List[ResponseItem]:
-    analyzed_dict = analyze_item(item.model_dump())
-    return [ResponseItem(**analyzed_dict)]
+    # Threads avoid the pickle cost of the process pool for one item
+    # while still keeping the event loop free during analysis.
+    return [await anyio.to_thread.run_sync(analyze_item, item)]